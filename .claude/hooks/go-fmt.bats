@@ -46,6 +46,51 @@ GO
   grep -q '	fmt.Println("hello")' "$TMPDIR/bad.go"
 }
 
+# --- Batched per session ---
+
+@test "defers formatting until Stop when session_id is present" {
+  cat > "$TMPDIR/bad.go" <<'GO'
+package main
+
+func main(   ) {
+fmt.Println(  "hello"  )
+}
+GO
+  session="bats-$$-$BATS_TEST_NUMBER"
+  result="$(run_hook "{\"session_id\":\"$session\",\"hook_event_name\":\"PostToolUse\",\"tool_name\":\"Edit\",\"tool_input\":{\"file_path\":\"$TMPDIR/bad.go\"}}")" || status=$?
+  [ "${status:-0}" -eq 0 ]
+  # Only queued so far
+  grep -q 'fmt.Println(  "hello"  )' "$TMPDIR/bad.go"
+
+  result="$(run_hook "{\"session_id\":\"$session\",\"hook_event_name\":\"Stop\"}")" || status=$?
+  [ "${status:-0}" -eq 0 ]
+  grep -q '	fmt.Println("hello")' "$TMPDIR/bad.go"
+}
+
+@test "flushes queued files on SessionEnd when Stop never fired" {
+  cat > "$TMPDIR/bad.go" <<'GO'
+package main
+
+func main(   ) {
+fmt.Println(  "hello"  )
+}
+GO
+  session="bats-$$-$BATS_TEST_NUMBER"
+  result="$(run_hook "{\"session_id\":\"$session\",\"hook_event_name\":\"PostToolUse\",\"tool_name\":\"Edit\",\"tool_input\":{\"file_path\":\"$TMPDIR/bad.go\"}}")" || status=$?
+  [ "${status:-0}" -eq 0 ]
+
+  result="$(run_hook "{\"session_id\":\"$session\",\"hook_event_name\":\"SessionEnd\",\"reason\":\"other\"}")" || status=$?
+  [ "${status:-0}" -eq 0 ]
+  grep -q '	fmt.Println("hello")' "$TMPDIR/bad.go"
+  # The queue file is cleaned up
+  [ -z "$(ls "${TMPDIR:-/tmp}"/moat-gofmt-"$session".queue* /tmp/moat-gofmt-"$session".queue* 2>/dev/null)" ]
+}
+
+@test "Stop with nothing queued is a no-op" {
+  result="$(run_hook "{\"session_id\":\"bats-$$-$BATS_TEST_NUMBER\",\"hook_event_name\":\"Stop\"}")" || status=$?
+  [ "${status:-0}" -eq 0 ]
+}
+
 # --- Should skip ---
 
 @test "skips non-Go files" {
@@ -61,6 +106,11 @@ GO
   [ "${status:-0}" -eq 0 ]
 }
 
+@test "skips when file_path is not a string" {
+  result="$(run_hook '{"tool_name":"Edit","tool_input":{"file_path":null}}')" || status=$?
+  [ "${status:-0}" -eq 0 ]
+}
+
 @test "skips .gob files (not tricked by partial extension)" {
   echo "binary data" > "$TMPDIR/data.gob"
   result="$(run_hook "{\"tool_name\":\"Edit\",\"tool_input\":{\"file_path\":\"$TMPDIR/data.gob\"}}")" || status=$?
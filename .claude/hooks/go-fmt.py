@@ -1,5 +1,12 @@
 #!/usr/bin/env python3
-"""Claude Code PostToolUse hook: format .go files after Edit/Write.
+"""Claude Code hook: format .go files touched by Edit/Write.
+
+As a PostToolUse hook it records each edited .go file in a per-session queue;
+as a Stop hook it formats everything queued in a single formatter run, so a
+turn that edits many files pays for one process spawn instead of one per edit.
+It is also registered for SessionEnd, which flushes edits from a turn that was
+interrupted or cut short and never reached Stop.
+Payloads without a usable session_id are formatted immediately.
 
 Prefers gofumpt (the stricter formatter CI's golangci-lint enforces) when it's
 installed, and falls back to gofmt (always available with the Go toolchain).
@@ -7,21 +14,120 @@ gofumpt is a superset of gofmt, so the fallback still formats — CI just enforc
 the remaining stricter rules.
 """
 
-import json
-import shutil
-import subprocess
+import os
 import sys
 
 
+def queue_path(session_id):
+    # Imported here: tempfile pulls in shutil, random and hashlib, which the
+    # non-Go fast path in main() never needs.
+    import tempfile
+
+    return os.path.join(tempfile.gettempdir(), f"moat-gofmt-{session_id}.queue")
+
+
+# Send the formatter's stdout/stderr to /dev/null; -w rewrites files in place.
+_QUIET = [
+    (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+    (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0),
+]
+
+
+def format_files(paths):
+    # posix_spawnp rather than subprocess: it saves importing subprocess (and
+    # its selectors/signal/threading dependencies) on every Go edit, and
+    # spawnp's PATH lookup doubles as the which().
+    if not paths:
+        return
+    for formatter in ("gofumpt", "gofmt"):
+        try:
+            pid = os.posix_spawnp(
+                formatter, [formatter, "-w", *paths], os.environ, file_actions=_QUIET,
+            )
+        except FileNotFoundError:
+            continue
+        os.waitpid(pid, 0)
+        return
+
+
+def flush(session_id):
+    """Format every queued file for the session and clear its queue."""
+    queue = queue_path(session_id)
+    # Move the queue aside first so edits recorded while we format land in a
+    # fresh queue for the next flush instead of being truncated away.
+    flushing = f"{queue}.{os.getpid()}"
+    try:
+        os.rename(queue, flushing)
+    except FileNotFoundError:
+        return
+    try:
+        with open(flushing, encoding="utf-8") as f:
+            paths = dict.fromkeys(line.rstrip("\n") for line in f)
+        format_files([p for p in paths if p and os.path.isfile(p)])
+    finally:
+        os.remove(flushing)
+
+
+def scan_string(buf, key):
+    """Return the value of the first "key": "..." pair in raw JSON bytes.
+
+    Returns None when the key is missing or the value is anything other than a
+    plain string without escapes; the caller then parses the payload properly.
+    """
+    i = buf.find(b'"' + key + b'"')
+    if i < 0:
+        return None
+    i += len(key) + 2
+    n = len(buf)
+    while i < n and buf[i] in b" \t\r\n":
+        i += 1
+    if i >= n or buf[i] != ord(":"):
+        return None
+    i += 1
+    while i < n and buf[i] in b" \t\r\n":
+        i += 1
+    if i >= n or buf[i] != ord('"'):
+        return None
+    j = buf.find(b'"', i + 1)
+    if j < 0 or b"\\" in buf[i + 1 : j]:
+        return None
+    return buf[i + 1 : j].decode("utf-8", "replace")
+
+
 def main():
-    data = json.load(sys.stdin)
+    buf = sys.stdin.buffer.read()
+
+    # Most edits in a session are not Go files. Spot those from the raw bytes
+    # and exit before importing json or parsing a payload that may carry a
+    # whole file's contents.
+    file_path = scan_string(buf, b"file_path")
+    if file_path is not None and not file_path.endswith(".go"):
+        sys.exit(0)
+
+    import json
+
+    data = json.loads(buf)
+
+    session_id = data.get("session_id")
+    if not isinstance(session_id, str) or not session_id.replace("-", "").isalnum():
+        session_id = None
+
+    if data.get("hook_event_name") in ("Stop", "SessionEnd"):
+        if session_id:
+            flush(session_id)
+        sys.exit(0)
+
+    tool_input = data.get("tool_input")
+    file_path = tool_input.get("file_path", "") if isinstance(tool_input, dict) else ""
+    if not isinstance(file_path, str) or not file_path.endswith(".go"):
+        sys.exit(0)
 
-    file_path = data.get("tool_input", {}).get("file_path", "")
-    if not file_path or not file_path.endswith(".go"):
+    if session_id is None or "\n" in file_path:
+        format_files([file_path])
         sys.exit(0)
 
-    formatter = "gofumpt" if shutil.which("gofumpt") else "gofmt"
-    subprocess.run([formatter, "-w", file_path], capture_output=True)
+    with open(queue_path(session_id), "a", encoding="utf-8") as f:
+        f.write(file_path + "\n")
 
 
 if __name__ == "__main__":
@@ -78,3 +78,15 @@ run_hook() {
   [ "${status:-0}" -eq 2 ]
   [[ "$result" == *"Force push is not allowed"* ]]
 }
+
+@test "blocks force push after a safe push on an earlier line" {
+  result="$(run_hook '{"tool_name":"Bash","tool_input":{"command":"git push origin my-feature\ngit push --force origin my-feature"}}')" || status=$?
+  [ "${status:-0}" -eq 2 ]
+  [[ "$result" == *"Force push is not allowed"* ]]
+}
+
+@test "force push message wins over an earlier push to main" {
+  result="$(run_hook '{"tool_name":"Bash","tool_input":{"command":"git push origin main\ngit push --force origin my-feature"}}')" || status=$?
+  [ "${status:-0}" -eq 2 ]
+  [[ "$result" == *"Force push is not allowed"* ]]
+}
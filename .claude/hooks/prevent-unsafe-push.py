@@ -5,8 +5,24 @@ import json
 import re
 import sys
 
+# Cheap gate: most Bash commands contain no git push, and this single search
+# lets them skip the unsafe-push checks entirely.
+_PUSH_RE = re.compile(r"\bgit\s+push\b")
+# Force push (--force or -f, but not --force-with-lease) and push to main in one
+# regex anchored at the start of the command. Each branch is a lookahead over
+# the whole command, tried in order, so a force push anywhere takes priority
+# over a push to main, even on an earlier line. When no force push is found the
+# main branch rescans the command. Both branches anchor on "git push" (handles
+# && and ; chains and multi-line commands).
+_UNSAFE_PUSH_RE = re.compile(
+    r"\A(?:"
+    r"(?=[\s\S]*?(?P<force>\bgit\s+push\b.*?(?:\s+--force(?!-with-lease)\b|\s+-f\b)))"
+    r"|(?=[\s\S]*?(?P<main>\bgit\s+push\b.*?\s+main\b))"
+    r")"
+)
+
 def main():
-    data = json.load(sys.stdin)
+    data = json.loads(sys.stdin.buffer.read())
 
     if data.get("tool_name") != "Bash":
         sys.exit(0)
@@ -15,17 +31,18 @@ def main():
     if not command:
         sys.exit(0)
 
-    # Check for git push anywhere in the command (handles && and ; chains)
-    if not re.search(r"\bgit\s+push\b", command):
+    if not _PUSH_RE.search(command):
+        sys.exit(0)
+
+    m = _UNSAFE_PUSH_RE.search(command)
+    if m is None:
         sys.exit(0)
 
-    # Block force push (--force or -f, but not --force-with-lease)
-    if re.search(r"\bgit\s+push\b.*(\s+--force(?!-with-lease)\b|\s+-f\b)", command):
+    if m.lastgroup == "force":
         print("Force push is not allowed. Use --force-with-lease if necessary.", file=sys.stderr)
         sys.exit(2)
 
-    # Block push to main
-    if re.search(r"\bgit\s+push\b.*\s+main\b", command):
+    if m.lastgroup == "main":
         print("Direct push to main is not allowed. Create a pull request instead.", file=sys.stderr)
         sys.exit(2)
 
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """Fibonacci calculator with a bug for testing."""
 
+from functools import lru_cache
 
+
+@lru_cache(maxsize=None)
 def fibonacci(n: int) -> int:
     """Calculate the nth Fibonacci number.
 
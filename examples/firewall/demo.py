@@ -12,36 +12,133 @@ Demonstrates fine-grained network rules with method + path matching:
   7. Direct socket bypass    → blocked (iptables firewall)
 """
 
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import http.client
 import socket
-import urllib.request
-import urllib.error
 import ssl
+import urllib.parse
+import urllib.request
+import zlib
 
 # Trust the Moat proxy's generated TLS certs
 ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
 ssl_context.verify_mode = ssl.CERT_NONE
 
+# Header the Moat proxy sets on responses it blocks, naming the blocking rule.
+BLOCKED_HEADER = "X-Moat-Blocked"
+
+# One keep-alive connection per host, so requests to the same host share a
+# single TLS handshake (and proxy CONNECT) instead of paying one each.
+_connections: dict[str, http.client.HTTPSConnection] = {}
+
+
+def _connection(host: str) -> http.client.HTTPSConnection:
+    """Return the cached connection for host, tunneling through HTTPS_PROXY if set."""
+    conn = _connections.get(host)
+    if conn is None:
+        proxy = urllib.request.getproxies().get("https")
+        if proxy and not urllib.request.proxy_bypass(host):
+            p = urllib.parse.urlsplit(proxy)
+            conn = http.client.HTTPSConnection(
+                p.hostname, p.port or 80, context=ssl_context, timeout=10,
+            )
+            # Moat puts its token in the proxy URL and checks it on every CONNECT.
+            headers = {}
+            if p.username:
+                user = urllib.parse.unquote(p.username)
+                password = urllib.parse.unquote(p.password or "")
+                token = base64.b64encode(f"{user}:{password}".encode()).decode()
+                headers["Proxy-Authorization"] = f"Basic {token}"
+            conn.set_tunnel(host, headers=headers)
+        else:
+            conn = http.client.HTTPSConnection(host, context=ssl_context, timeout=10)
+        _connections[host] = conn
+    return conn
+
+
+def _discard(host: str):
+    """Close and forget the cached connection for host."""
+    conn = _connections.pop(host, None)
+    if conn is not None:
+        conn.close()
 
-def make_request(url: str, method: str = "GET") -> tuple[int, str, dict]:
-    """Make HTTP request, return (status_code, body, headers)."""
+
+def _read_body(resp: http.client.HTTPResponse, limit: int) -> bytes:
+    """Read up to limit bytes of the decoded body, inflating gzip as it streams."""
+    if resp.headers.get("Content-Encoding") != "gzip":
+        return resp.read(limit)
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = b""
+    while len(out) < limit and not d.eof:
+        chunk = d.unconsumed_tail or resp.read(1024)
+        if not chunk:
+            break
+        try:
+            out += d.decompress(chunk, limit - len(out))
+        except zlib.error:
+            # Corrupt gzip body: keep what decoded cleanly. If any of the body
+            # is still unread, make_request drops the connection.
+            break
+    return out
+
+
+def _send(host: str, method: str, target: str) -> http.client.HTTPResponse:
+    """Send a request on host's cached connection and return the response.
+
+    A kept-alive connection the server closed while idle only fails on its next
+    use. That says nothing about the policy, so retry once on a fresh connection.
+    """
+    conn = _connection(host)
+    reused = conn.sock is not None
     try:
-        req = urllib.request.Request(url, method=method)
-        with urllib.request.urlopen(req, timeout=10, context=ssl_context) as resp:
-            return resp.status, resp.read().decode()[:500], dict(resp.headers)
-    except urllib.error.HTTPError as e:
-        return e.code, e.read().decode()[:500], dict(e.headers)
-    except urllib.error.URLError as e:
-        reason = str(e.reason)
+        conn.request(method, target, headers={"Accept-Encoding": "gzip"})
+        return conn.getresponse()
+    except ConnectionError:
+        # Includes RemoteDisconnected and BrokenPipeError.
+        if not reused:
+            raise
+    _discard(host)
+    conn = _connection(host)
+    conn.request(method, target, headers={"Accept-Encoding": "gzip"})
+    return conn.getresponse()
+
+
+def make_request(
+    url: str, method: str = "GET",
+) -> tuple[int, str, http.client.HTTPMessage | dict]:
+    """Make HTTP request, return (status_code, body, headers).
+
+    headers is the response's own HTTPMessage rather than a copy; callers only
+    look up single keys, which it supports (case-insensitively).
+    """
+    u = urllib.parse.urlsplit(url)
+    target = urllib.parse.urlunsplit(("", "", u.path or "/", u.query, ""))
+    try:
+        resp = _send(u.netloc, method, target)
+        body = _read_body(resp, 500).decode(errors="replace")
+        if not resp.isclosed():
+            # Body was longer than we keep. Drop the connection rather than
+            # draining the rest just to reuse it.
+            _discard(u.netloc)
+        return resp.status, body, resp.headers
+    except (http.client.HTTPException, OSError) as e:
+        # The connection is in an unknown state; drop it so the next
+        # request to this host starts fresh.
+        _discard(u.netloc)
+        reason = str(e)
         if "407" in reason:
             return 407, reason, {}
         return 0, reason, {}
 
 
-def run_test(num: int, desc: str, url: str, method: str, expect_allowed: bool):
-    """Run a single test and print the result."""
-    print(f"Test {num}: {desc}")
-    print(f"  {method} {url}")
+def run_test(
+    out: list[str], num: int, desc: str, url: str, method: str, expect_allowed: bool,
+) -> bool:
+    """Run a single test and append the result lines to out."""
+    out.append(f"Test {num}: {desc}")
+    out.append(f"  {method} {url}")
 
     status, body, headers = make_request(url, method)
 
@@ -54,98 +151,118 @@ def run_test(num: int, desc: str, url: str, method: str, expect_allowed: bool):
         result = "FAIL"
 
     if allowed:
-        print(f"  → {status} OK")
+        out.append(f"  → {status} OK")
     elif status == 407:
-        blocked_by = headers.get("X-Moat-Blocked", "network-policy")
-        print(f"  → Blocked ({blocked_by})")
+        blocked_by = headers.get(BLOCKED_HEADER, "network-policy")
+        out.append(f"  → Blocked ({blocked_by})")
     else:
-        print(f"  → Connection refused")
+        out.append(f"  → Connection refused")
 
     label = "allowed" if expect_allowed else "blocked"
-    print(f"  [{result}] Expected: {label}")
-    print()
+    out.append(f"  [{result}] Expected: {label}")
+    out.append("")
     return result == "PASS"
 
 
-def main():
-    print("=" * 55)
-    print("  Network Firewall Demo — HTTP Request Rules")
-    print("=" * 55)
-    print()
-    print("  Policy: strict (default deny)")
-    print("  Rules: method + path patterns per host")
-    print()
+def resolve_ipv4(host: str) -> str:
+    """Resolve host to its first IPv4 address; example.com's IPs change over time."""
+    return socket.getaddrinfo(host, 80, family=socket.AF_INET)[0][4][0]
 
-    results = []
 
-    # --- httpbin.org: allow GET, deny everything else ---
-    print("-" * 55)
-    print("  httpbin.org — allow GET only")
-    print("-" * 55)
-    print()
+def run_socket_test(out: list[str]) -> bool:
+    """Try a raw socket to example.com:80, bypassing HTTP_PROXY."""
+    out.append("Test 7: Raw socket to example.com:80")
+    out.append("  Bypasses HTTP_PROXY env var")
 
-    results.append(run_test(
-        1, "GET allowed by 'allow GET /**'",
-        "https://httpbin.org/get", "GET", expect_allowed=True,
-    ))
+    # A DNS failure says nothing about whether iptables blocks the bypass, so
+    # it must not count as a pass.
+    try:
+        ip = resolve_ipv4("example.com")
+    except socket.gaierror as e:
+        out.append(f"  → Could not resolve example.com ({e})")
+        out.append("  [FAIL] Inconclusive: no address to probe")
+        return False
 
-    results.append(run_test(
-        2, "POST blocked by 'deny * /**'",
-        "https://httpbin.org/post", "POST", expect_allowed=False,
-    ))
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect((ip, 80))
+        sock.close()
+        out.append("  → Connected (unexpected)")
+        out.append("  [FAIL] Expected: blocked")
+        return False
+    except (socket.timeout, OSError) as e:
+        out.append(f"  → Blocked ({e})")
+        out.append("  [PASS] Expected: blocked")
+        return True
 
-    # --- api.github.com: path-based rules ---
-    print("-" * 55)
-    print("  api.github.com — path-based access control")
-    print("-" * 55)
-    print()
 
-    results.append(run_test(
-        3, "GET /repos/moat allowed by 'allow GET /repos/*'",
-        "https://api.github.com/repos/moat", "GET", expect_allowed=True,
-    ))
+# Tests are grouped by host. Each group runs sequentially so it can share one
+# keep-alive connection; the groups themselves run concurrently.
+HTTP_SECTIONS = [
+    ("httpbin.org — allow GET only", [
+        (1, "GET allowed by 'allow GET /**'",
+         "https://httpbin.org/get", "GET", True),
+        (2, "POST blocked by 'deny * /**'",
+         "https://httpbin.org/post", "POST", False),
+    ]),
+    ("api.github.com — path-based access control", [
+        (3, "GET /repos/moat allowed by 'allow GET /repos/*'",
+         "https://api.github.com/repos/moat", "GET", True),
+        (4, "DELETE blocked by 'deny * /**'",
+         "https://api.github.com/repos/moat", "DELETE", False),
+        (5, "GET /admin/users blocked by 'deny * /admin/**'",
+         "https://api.github.com/admin/users", "GET", False),
+    ]),
+    ("example.com — unlisted host (strict = deny)", [
+        (6, "Blocked by strict policy (host not in rules)",
+         "https://example.com", "GET", False),
+    ]),
+]
+
+SOCKET_SECTION = "Direct socket — iptables blocks proxy bypass"
+
 
-    results.append(run_test(
-        4, "DELETE blocked by 'deny * /**'",
-        "https://api.github.com/repos/moat", "DELETE", expect_allowed=False,
-    ))
+def run_section(tests: list[tuple]) -> tuple[list[str], list[bool]]:
+    """Run a group of HTTP tests in order, returning output lines and results."""
+    out: list[str] = []
+    results = [run_test(out, *test) for test in tests]
+    return out, results
 
-    results.append(run_test(
-        5, "GET /admin/users blocked by 'deny * /admin/**'",
-        "https://api.github.com/admin/users", "GET", expect_allowed=False,
-    ))
 
-    # --- example.com: not in rules, strict policy blocks ---
+def print_header(title: str):
     print("-" * 55)
-    print("  example.com — unlisted host (strict = deny)")
+    print(f"  {title}")
     print("-" * 55)
     print()
 
-    results.append(run_test(
-        6, "Blocked by strict policy (host not in rules)",
-        "https://example.com", "GET", expect_allowed=False,
-    ))
 
-    # --- Direct socket bypass ---
-    print("-" * 55)
-    print("  Direct socket — iptables blocks proxy bypass")
-    print("-" * 55)
+def main():
+    print("=" * 55)
+    print("  Network Firewall Demo — HTTP Request Rules")
+    print("=" * 55)
+    print()
+    print("  Policy: strict (default deny)")
+    print("  Rules: method + path patterns per host")
     print()
-    print("Test 7: Raw socket to example.com:80")
-    print("  Bypasses HTTP_PROXY env var")
 
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        sock.connect(("93.184.216.34", 80))
-        sock.close()
-        print("  → Connected (unexpected)")
-        print("  [FAIL] Expected: blocked")
-        results.append(False)
-    except (socket.timeout, OSError) as e:
-        print(f"  → Blocked ({e})")
-        print("  [PASS] Expected: blocked")
-        results.append(True)
+    # Every probe is network-bound (up to 10s on timeout) and they target
+    # different endpoints, so run them in parallel and print in a fixed order.
+    with ThreadPoolExecutor(max_workers=len(HTTP_SECTIONS) + 1) as pool:
+        http_futures = [pool.submit(run_section, tests) for _, tests in HTTP_SECTIONS]
+        socket_out: list[str] = []
+        socket_future = pool.submit(run_socket_test, socket_out)
+
+        results = []
+        for (title, _), future in zip(HTTP_SECTIONS, http_futures):
+            out, section_results = future.result()
+            print_header(title)
+            print("\n".join(out))
+            results.extend(section_results)
+
+        print_header(SOCKET_SECTION)
+        results.append(socket_future.result())
+        print("\n".join(socket_out))
 
     # --- Summary ---
     print()
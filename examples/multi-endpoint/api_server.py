@@ -1,25 +1,65 @@
 #!/usr/bin/env python3
 """Simple API server that responds with a greeting on port 8080."""
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import os
+import queue
+import sys
+import threading
+import time
 
 PORT = 8080
+BODY = f"Hello from port {PORT}! (api endpoint)\n".encode()
+# Full response (status line, headers, body) built once, so each request is a
+# single write to the socket.
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: " + str(len(BODY)).encode() + b"\r\n"
+    b"\r\n" + BODY
+)
+
+# Request log lines are queued by handler threads and written by one background
+# thread in batches, so serving a request never waits on stdout.
+_LOG_Q = queue.SimpleQueue()
+
+
+def _drain_log():
+    while True:
+        batch = [_LOG_Q.get()]
+        deadline = time.monotonic() + 0.1
+        while len(batch) < 64:
+            try:
+                batch.append(_LOG_Q.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        sys.stdout.write("\n".join(batch) + "\n")
+        sys.stdout.flush()
+
+
+threading.Thread(target=_drain_log, daemon=True).start()
+
+
+class Server(ThreadingHTTPServer):
+    # socketserver listens with a backlog of 5, which stalls or drops connections
+    # once more than a handful of clients connect at once.
+    request_queue_size = 128
 
 
 class Handler(BaseHTTPRequestHandler):
+    # Content-Length is always sent, so clients can keep the connection open.
+    protocol_version = "HTTP/1.1"
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.end_headers()
-        self.wfile.write(f"Hello from port {PORT}! (api endpoint)\n".encode())
+        self.log_request(200)
+        self.wfile.write(RESPONSE)
 
     def log_message(self, format, *args):
-        print(f"[api] {args[0]}")
+        _LOG_Q.put_nowait(f"[api] {args[0]}")
 
 
 if __name__ == "__main__":
-    server = HTTPServer(("0.0.0.0", PORT), Handler)
+    server = Server(("0.0.0.0", PORT), Handler)
     print(f"API server running on port {PORT}")
     print(f"MOAT_URL_API={os.environ.get('MOAT_URL_API', 'not set')}")
     server.serve_forever()